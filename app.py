@@ -1,36 +1,104 @@
 import streamlit as st
 import requests
-from bs4 import BeautifulSoup
+import aiohttp
+import asyncio
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from lxml import etree
+from io import BytesIO
 import time
 import threading
-import queue
+from collections import OrderedDict
 import re
 import urllib.robotparser
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urljoin, urlsplit, urlunsplit, unquote_plus
 import sqlite3
 from datetime import datetime
 import nltk
-from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
 import string
+import functools
+import hashlib
+import math
+
+
+# Load common stop words once, downloading them only if they are missing
+def _load_stopwords():
+    try:
+        return frozenset(stopwords.words('english'))
+    except LookupError:
+        nltk.download('stopwords', quiet=True)
+        return frozenset(stopwords.words('english'))
+
+
+_STOP = _load_stopwords()
+# Runs of letters and digits (Unicode-aware, underscores excluded)
+_TOKEN_RE = re.compile(r"[^\W_]+")
 
-nltk.download('punkt_tab')
-nltk.download('stopwords')
 
 # Function to extract keywords from the query
 def extract_keywords(query):
-    stop_words = set(stopwords.words('english'))  # Get common stop words
-    words = word_tokenize(query)  # Tokenize the query
-    keywords = [word.lower() for word in words if word.isalnum() and word.lower() not in stop_words]
-    return keywords  # Returns a list of keywords
+    return [w for w in _TOKEN_RE.findall(query.lower()) if w not in _STOP]  # Returns a list of keywords
 
 
-# Initialize database with better thread handling
-def init_db():
+DB_PATH = 'search_engine.db'
+
+# Per-thread caches of read-write and read-only connections
+_writers = threading.local()
+_readers = threading.local()
+
+
+def _apply_pragmas(conn):
+    # Let SQLite wait on locks itself instead of retrying in Python
+    conn.execute('PRAGMA busy_timeout=30000')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')
+
+
+# Open a read-write connection; each writing thread gets its own via get_writer()
+def open_writer():
     # Use a connection timeout to prevent locking issues
-    conn = sqlite3.connect('search_engine.db', check_same_thread=False, timeout=30.0)
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, timeout=30.0)
     # Enable WAL mode to improve concurrency
     conn.execute('PRAGMA journal_mode=WAL')
+    # WAL only needs fsync at checkpoints to stay consistent
+    conn.execute('PRAGMA synchronous=NORMAL')
+    # INSERT OR REPLACE only fires the pages_fts delete trigger when recursive
+    # triggers are on; this is per connection, so every writer needs it
+    conn.execute('PRAGMA recursive_triggers=ON')
+    _apply_pragmas(conn)
+    return conn
+
+
+# Get the calling thread's writer connection; WAL and busy_timeout serialize
+# writes from different threads and processes
+def get_writer():
+    conn = getattr(_writers, 'conn', None)
+    if conn is None:
+        conn = open_writer()
+        _writers.conn = conn
+    return conn
+
+
+# Open a read-only connection; WAL lets these run alongside the writer
+def open_reader():
+    conn = sqlite3.connect(f'file:{DB_PATH}?mode=ro', uri=True, check_same_thread=False, timeout=30.0)
+    _apply_pragmas(conn)
+    return conn
+
+
+# Get the calling thread's reader connection, opening it on first use
+def get_reader():
+    conn = getattr(_readers, 'conn', None)
+    if conn is None:
+        conn = open_reader()
+        _readers.conn = conn
+    return conn
+
+
+# Initialize database schema and return the writer connection
+def init_db():
+    conn = get_writer()
     c = conn.cursor()
     c.execute('''
     CREATE TABLE IF NOT EXISTS pages (
@@ -48,34 +116,279 @@ def init_db():
         added_at TIMESTAMP
     )
     ''')
+    # Index the dequeue order and the sidebar's recently-crawled listing
+    c.execute("CREATE INDEX IF NOT EXISTS idx_queue_prio ON crawl_queue(priority, added_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_pages_last ON pages(last_crawled DESC)")
+    # Earliest time each domain may be fetched again, shared by every crawler
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS domain_slots (
+        domain TEXT PRIMARY KEY,
+        next_ok REAL
+    )
+    ''')
+    # Full-text index over pages, kept in sync by triggers (see open_writer)
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pages_fts'")
+    fts_exists = c.fetchone() is not None
+    c.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(
+        url,
+        title,
+        content,
+        tokenize='porter unicode61'
+    )
+    ''')
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_fts_insert AFTER INSERT ON pages BEGIN
+        INSERT INTO pages_fts(rowid, url, title, content)
+        VALUES (new.rowid, new.url, new.title, new.content);
+    END
+    ''')
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_fts_delete AFTER DELETE ON pages BEGIN
+        DELETE FROM pages_fts WHERE rowid = old.rowid;
+    END
+    ''')
+    c.execute('''
+    CREATE TRIGGER IF NOT EXISTS pages_fts_update AFTER UPDATE ON pages BEGIN
+        DELETE FROM pages_fts WHERE rowid = old.rowid;
+        INSERT INTO pages_fts(rowid, url, title, content)
+        VALUES (new.rowid, new.url, new.title, new.content);
+    END
+    ''')
+    if not fts_exists:
+        # Index pages crawled before the FTS table existed
+        c.execute('''
+        INSERT INTO pages_fts(rowid, url, title, content)
+        SELECT rowid, url, title, content FROM pages
+        ''')
+
+    # One-time migrations, tracked in user_version so reruns don't repeat them
+    c.execute("PRAGMA user_version")
+    if c.fetchone()[0] < 1:
+        # Drop index rows left behind by replaced pages before recursive
+        # triggers were enabled on every writer
+        c.execute("DELETE FROM pages_fts WHERE rowid NOT IN (SELECT rowid FROM pages)")
+        c.execute("PRAGMA user_version = 1")
     conn.commit()
     return conn
 
 
+# Outcomes of RespectfulCrawler.add_url_to_queue
+QUEUED = 'queued'  # Newly queued, or moved up to a higher priority
+ALREADY_QUEUED = 'already_queued'  # Already waiting at the same or a higher priority, or in flight
+ALREADY_INDEXED = 'already_indexed'
+INVALID_URL = 'invalid_url'
+DB_ERROR = 'db_error'
+
+TRACKING_PARAMS = frozenset(['fbclid', 'gclid'])
+DEFAULT_PORTS = {'http': ':80', 'https': ':443'}
+
+
+# Canonical form of a URL so trivially different spellings are crawled once:
+# lowercase scheme and host, no default port, dot segments resolved, no trailing
+# slash (except the root), tracking parameters removed, query sorted by key, no fragment
+def canonicalize(url):
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+
+    netloc = parts.netloc.lower()
+    default_port = DEFAULT_PORTS.get(scheme)
+    if default_port and netloc.endswith(default_port):
+        netloc = netloc[:-len(default_port)]
+
+    segments = []
+    for segment in parts.path.split('/'):
+        if segment == '.':
+            continue
+        if segment == '..':
+            if len(segments) > 1:
+                segments.pop()
+            continue
+        segments.append(segment)
+    path = '/'.join(segments) or '/'
+    if path != '/':
+        path = path.rstrip('/') or '/'
+
+    # Work on the raw key=value pieces so values (and value-less flags) stay byte-for-byte;
+    # the sort is stable and by key only, so repeated keys keep their order
+    params = []
+    for param in parts.query.split('&'):
+        if not param:
+            continue
+        key = unquote_plus(param.split('=', 1)[0])
+        if key.lower().startswith('utm_') or key.lower() in TRACKING_PARAMS:
+            continue
+        params.append((key, param))
+    query = '&'.join(param for _, param in sorted(params, key=lambda kv: kv[0]))
+
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+TEXT_TAGS = frozenset(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])
+MAX_PAGE_BYTES = 5 * 1024 * 1024  # Skip pages larger than this
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+
+# Stream through an HTML document, keeping only the title, p/h1-h6 text and link
+# targets; elements are discarded as soon as they close, so memory stays flat
+def parse_stream(html_bytes, encoding=None):
+    if not encoding:
+        # libxml2 falls back to Latin-1, so look for a declared charset first
+        match = _META_CHARSET_RE.search(html_bytes[:2048])
+        encoding = match.group(1).decode('ascii') if match else 'utf-8'
+
+    title = None
+    words = []  # Whitespace-free tokens of the page text
+    hrefs = []
+    text_depth = 0  # How many open p/h1-h6 elements we are inside
+
+    for event, elem in etree.iterparse(BytesIO(html_bytes), events=('start', 'end'), html=True,
+                                       encoding=encoding, recover=True):
+        tag = elem.tag if isinstance(elem.tag, str) else ''
+        if event == 'start':
+            if tag in TEXT_TAGS:
+                text_depth += 1
+            elif tag == 'a':
+                href = elem.get('href')
+                if href:
+                    hrefs.append(href)
+            continue
+
+        if tag == 'title' and title is None:
+            title = elem.text or ''
+        elif tag in TEXT_TAGS:
+            text_depth -= 1
+            if text_depth == 0:
+                # str.split() drops and collapses whitespace in one pass
+                words.extend(''.join(elem.itertext()).split())
+
+        # Nested elements are still needed until the enclosing text tag closes
+        if text_depth == 0:
+            elem.clear(keep_tail=True)
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+    return title, ' '.join(words), hrefs
+
+
+# Fixed-size Bloom filter over strings
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # Double hashing: derive every probe from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, item):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+    def add(self, item):
+        for p in self._positions(item):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+# Bloom filter that adds a larger, stricter filter each time the last one fills up,
+# keeping the overall false positive rate under error_rate
+class ScalableBloomFilter:
+    def __init__(self, initial_capacity=100_000, error_rate=1e-4):
+        self.error_rate = error_rate
+        self.filters = [BloomFilter(initial_capacity, error_rate / 2)]
+
+    def __contains__(self, item):
+        return any(item in f for f in self.filters)
+
+    def add(self, item):
+        last = self.filters[-1]
+        if last.count >= last.capacity:
+            last = BloomFilter(last.capacity * 2, error_rate=self.error_rate / 2 ** (len(self.filters) + 1))
+            self.filters.append(last)
+        last.add(item)
+
+
 # Crawler class
 class RespectfulCrawler:
-    def __init__(self, db_connection):
-        self.conn = db_connection
-        self.crawl_queue = queue.PriorityQueue()
-        self.visited_urls = set()
-        self.robot_parsers = {}
-        self.domain_last_access = {}
+    def __init__(self):
+        self.visited = ScalableBloomFilter(initial_capacity=100_000, error_rate=1e-4)
+        self.robot_parsers = OrderedDict()  # Domain -> (parser or None, expires_at), LRU order
+        self.robots_ttl = 12 * 60 * 60  # Re-fetch robots.txt after this many seconds
+        self.robots_failure_ttl = 10 * 60  # Retry failed robots.txt fetches sooner
+        self.robots_cache_size = 1024
+        self._robots_lock = threading.Lock()
+        self.domain_slots = {}  # Local copy of domain_slots.next_ok, refreshed on each claim
+        self.slot_lease = 60  # Seconds a claimed domain stays reserved if its fetch never finishes
         self.crawl_delay = 5  # Default crawl delay in seconds
         self.running = False
-        self.lock = threading.Lock()
+        self.max_workers = 50  # Concurrent fetches, at most one per domain
+
+        # Keep-alive session for robots.txt lookups, which run on executor threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers,
+                              max_retries=Retry(total=2, backoff_factor=0.5))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'User-Agent': 'StreatmlitSearchBot/1.0 (respectful research crawler)',
+            'Accept-Encoding': 'gzip, deflate',
+        })
+        self.dequeue_batch_size = 32  # URLs claimed from crawl_queue per transaction
+        self.dequeue_window = 1000  # Queue rows scanned per dequeue when looking for open domains
+        self.backlog_per_domain = 4  # Claimed-but-unfetched URLs kept per domain
+        self._next_dequeue = 0  # Back off dequeuing while every queued domain is full
+        self.flush_every = 50  # Flush buffered pages after this many...
+        self.flush_interval = 5  # ...or this many seconds
+        self._pending_pages = []
+        self._last_flush = time.time()
 
     def get_robot_parser(self, url):
         domain = urlparse(url).netloc
-        if domain not in self.robot_parsers:
-            rp = urllib.robotparser.RobotFileParser()
-            robots_url = f"https://{domain}/robots.txt"
-            try:
-                rp.set_url(robots_url)
-                rp.read()
-                self.robot_parsers[domain] = rp
-            except Exception as e:
-                self.robot_parsers[domain] = None
-        return self.robot_parsers[domain]
+        with self._robots_lock:
+            entry = self.robot_parsers.get(domain)
+            if entry:
+                rp, expires_at = entry
+                if time.time() < expires_at:
+                    self.robot_parsers.move_to_end(domain)
+                    return rp
+
+        rp = urllib.robotparser.RobotFileParser()
+        robots_url = f"https://{domain}/robots.txt"
+        ttl = self.robots_ttl
+        try:
+            # Fetch ourselves so the timeout applies; RobotFileParser.read() has none
+            response = self.session.get(robots_url, timeout=5)
+            if response.status_code in (401, 403):
+                rp.disallow_all = True
+            elif 400 <= response.status_code < 500:
+                rp.allow_all = True
+            elif response.status_code >= 500:
+                # Server errors mean full disallow (RFC 9309), but check again soon
+                rp.disallow_all = True
+                ttl = self.robots_failure_ttl
+            elif response.status_code == 200:
+                rp.parse(response.text.splitlines())
+            else:
+                rp = None
+                ttl = self.robots_failure_ttl
+        except Exception as e:
+            rp = None
+            ttl = self.robots_failure_ttl
+
+        with self._robots_lock:
+            self.robot_parsers[domain] = (rp, time.time() + ttl)
+            self.robot_parsers.move_to_end(domain)
+            while len(self.robot_parsers) > self.robots_cache_size:
+                self.robot_parsers.popitem(last=False)
+        return rp
 
     def can_fetch(self, url):
         rp = self.get_robot_parser(url)
@@ -92,96 +405,237 @@ class RespectfulCrawler:
                 return delay
         return self.crawl_delay
 
+    # Whether url may be fetched, and the delay to keep before the next request to its
+    # domain; may fetch robots.txt, so the event loop runs it on an executor thread
+    def check_robots(self, url):
+        return self.can_fetch(url), self.get_crawl_delay(url)
+
+    # Crawler state lives in SQLite so any number of crawler threads or processes
+    # can share it; each thread writes through its own connection
+    @property
+    def conn(self):
+        return get_writer()
+
+    # Return the URLs that have been crawled; sample rows have no last_crawled
+    def _crawled(self, urls):
+        crawled = set()
+        c = self.conn.cursor()
+        for i in range(0, len(urls), 500):
+            chunk = urls[i:i + 500]
+            placeholders = ', '.join('?' * len(chunk))
+            c.execute(f"SELECT url FROM pages WHERE url IN ({placeholders}) AND last_crawled IS NOT NULL", chunk)
+            crawled.update(url for url, in c.fetchall())
+        return crawled
+
+    # Queue a single URL and report what happened (QUEUED, ALREADY_QUEUED, ...)
     def add_url_to_queue(self, url, priority=1):
-        if not url or url in self.visited_urls:
-            return
+        try:
+            url = canonicalize(url)
+        except ValueError:
+            return INVALID_URL
+        if not url.startswith(('http://', 'https://')) or not urlparse(url).netloc:
+            return INVALID_URL
 
-        with self.lock:
+        try:
+            if self._crawled([url]):
+                return ALREADY_INDEXED
+        except sqlite3.OperationalError:
+            return DB_ERROR
+
+        changed = self.add_urls_to_queue([url], priority)
+        if changed is None:
+            return DB_ERROR
+        return QUEUED if changed else ALREADY_QUEUED
+
+    # Queue many URLs with a single transaction, skipping URLs that have already
+    # been crawled; a URL already queued moves up if the new priority is higher.
+    # Returns how many rows were inserted or moved up, or None on a database error
+    def add_urls_to_queue(self, urls, priority=1):
+        now = datetime.now()
+        canonical = []
+        for url in urls:
             try:
-                c = self.conn.cursor()
-                c.execute("INSERT OR IGNORE INTO crawl_queue VALUES (?, ?, ?)",
-                          (url, priority, datetime.now()))
-                self.conn.commit()
-                self.crawl_queue.put((priority, url))
-            except sqlite3.OperationalError as e:
-                # If database is locked, wait and retry
-                time.sleep(1)
-                self.add_url_to_queue(url, priority)
-            except Exception as e:
-                pass
-
-    def extract_links(self, soup, base_url):
+                canonical.append(canonicalize(url) if url else url)
+            except ValueError:
+                continue
+        urls = [url for url in dict.fromkeys(canonical) if url and url not in self.visited]
+        if not urls:
+            return 0
+
+        try:
+            crawled = self._crawled(urls)
+            rows = [(url, priority, now) for url in urls if url not in crawled]
+            if not rows:
+                return 0
+
+            self.conn.execute('BEGIN IMMEDIATE')
+            changes_before = self.conn.total_changes
+            self.conn.executemany('''
+            INSERT INTO crawl_queue VALUES (?, ?, ?)
+            ON CONFLICT(url) DO UPDATE SET priority = excluded.priority
+            WHERE excluded.priority < crawl_queue.priority
+            ''', rows)
+            changed = self.conn.total_changes - changes_before
+            self.conn.commit()
+            return changed
+        except sqlite3.OperationalError as e:
+            self.conn.rollback()
+            return None
+
+    def extract_links(self, hrefs, base_url):
         links = []
-        for link in soup.find_all('a', href=True):
-            href = link['href']
-            full_url = urljoin(base_url, href)
-            # Filter out non-http(s) URLs and fragments
-            if full_url.startswith(('http://', 'https://')) and '#' not in full_url:
+        for href in hrefs:
+            try:
+                full_url = canonicalize(urljoin(base_url, href))
+            except ValueError:
+                continue
+            # Filter out non-http(s) URLs
+            if full_url.startswith(('http://', 'https://')):
                 links.append(full_url)
         return links
 
-    def crawl_page(self, url):
-        domain = urlparse(url).netloc
+    # Parse a fetched page; CPU-bound, so it runs on an executor thread
+    # base_url is where the body was actually served from (after redirects); relative
+    # links resolve against it, since the canonical url may have lost a trailing slash
+    def parse_page(self, url, body, encoding=None, base_url=None):
+        title, text_content, hrefs = parse_stream(body, encoding)
 
-        # Respect crawl delays
-        current_time = time.time()
-        if domain in self.domain_last_access:
-            time_passed = current_time - self.domain_last_access[domain]
-            delay_needed = self.get_crawl_delay(url)
-            if time_passed < delay_needed:
-                time.sleep(delay_needed - time_passed)
+        # Fall back to the URL when the page has no title
+        if title is None:
+            title = url
 
-        # Update last access time
-        self.domain_last_access[domain] = time.time()
+        page = (url, title, text_content, datetime.now(), datetime.now())
 
-        # Check robots.txt
-        if not self.can_fetch(url):
-            return []
+        # Extract links for further crawling
+        links = self.extract_links(hrefs, base_url or url)
+        return page, links
+
+    # Fetch and parse a page without touching the database
+    # Returns (page, links, crawl delay)
+    async def crawl_page(self, session, url):
+        loop = asyncio.get_running_loop()
+        delay = self.crawl_delay
 
         try:
-            headers = {
-                'User-Agent': 'StreatmlitSearchBot/1.0 (respectful research crawler)'
-            }
-            response = requests.get(url, headers=headers, timeout=10)
-            self.domain_last_access[domain] = time.time()
-
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.text, 'html.parser')
-
-                # Extract title and text content
-                title = soup.title.string if soup.title else url
-
-                # Extract text and remove extra whitespace
-                text_content = ' '.join(
-                    [p.get_text() for p in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'])])
-                text_content = re.sub(r'\s+', ' ', text_content).strip()
-
-                # Store in database with retry logic
-                retry_count = 0
-                while retry_count < 3:
-                    with self.lock:
-                        try:
-                            c = self.conn.cursor()
-                            c.execute('''
-                            INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)
-                            ''', (url, title, text_content, datetime.now(), datetime.now()))
-                            self.conn.commit()
-                            break
-                        except sqlite3.OperationalError:
-                            # If database is locked, wait and retry
-                            retry_count += 1
-                            time.sleep(1)
-                        except Exception as e:
-                            break
-
-                # Extract links for further crawling
-                links = self.extract_links(soup, url)
-                return links
+            # Check robots.txt
+            allowed, delay = await loop.run_in_executor(None, self.check_robots, url)
+            if not allowed:
+                return None, [], delay
+
+            async with session.get(url) as response:
+                # Only parse HTML of a sensible size; check the headers before reading the body
+                if (response.status != 200 or response.content_type != 'text/html'
+                        or (response.content_length or 0) > MAX_PAGE_BYTES):
+                    response.close()
+                    return None, [], delay
+
+                # Content-Length may be missing or wrong, so cap what we read
+                chunks = []
+                size = 0
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= MAX_PAGE_BYTES:
+                        response.close()
+                        break
+                body = b''.join(chunks)[:MAX_PAGE_BYTES]
+
+                page, links = await loop.run_in_executor(None, self.parse_page, url, body,
+                                                         response.charset, str(response.url))
+                return page, links, delay
 
         except Exception as e:
             pass
 
-        return []
+        return None, [], delay
+
+    def _flush_pages(self):
+        self._last_flush = time.time()
+        if not self._pending_pages:
+            return
+
+        rows, self._pending_pages = self._pending_pages, []
+        try:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.executemany('''
+            INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            self.conn.rollback()
+
+    # Claim the next batch of URLs, skipping domains that already have
+    # backlog_per_domain URLs claimed so one slow host can't crowd out the rest
+    def _dequeue_batch(self, domain_counts):
+        try:
+            c = self.conn.cursor()
+            c.execute("SELECT url, priority FROM crawl_queue ORDER BY priority, added_at LIMIT ?",
+                      (self.dequeue_window,))
+
+            counts = dict(domain_counts)
+            picked = []
+            for url, priority in c.fetchall():
+                domain = urlparse(url).netloc
+                if counts.get(domain, 0) >= self.backlog_per_domain:
+                    continue
+                counts[domain] = counts.get(domain, 0) + 1
+                picked.append((url, priority))
+                if len(picked) >= self.dequeue_batch_size:
+                    break
+
+            if not picked:
+                return []
+
+            # Another crawler may have claimed some of these since the SELECT
+            batch = []
+            c.execute('BEGIN IMMEDIATE')
+            for url, priority in picked:
+                c.execute("DELETE FROM crawl_queue WHERE url = ?", (url,))
+                if c.rowcount:
+                    batch.append((url, priority))
+            self.conn.commit()
+
+            # Another crawler may have stored some of these since they were queued
+            crawled = self._crawled([url for url, _ in batch])
+            return [(url, priority) for url, priority in batch if url not in crawled]
+        except sqlite3.OperationalError:
+            self.conn.rollback()
+            return []
+
+    # Reserve domains whose slot has opened, so no other crawler fetches them meanwhile
+    def _claim_domains(self, domains, now):
+        claimed = set()
+        if not domains:
+            return claimed
+
+        try:
+            c = self.conn.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            for domain in domains:
+                c.execute('''
+                INSERT INTO domain_slots VALUES (?, ?)
+                ON CONFLICT(domain) DO UPDATE SET next_ok = excluded.next_ok
+                WHERE next_ok <= ?
+                ''', (domain, now + self.slot_lease, now))
+                if c.rowcount:
+                    claimed.add(domain)
+                else:
+                    c.execute("SELECT next_ok FROM domain_slots WHERE domain = ?", (domain,))
+                    self.domain_slots[domain] = c.fetchone()[0]
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            self.conn.rollback()
+            return set()
+        return claimed
+
+    # Release a domain, making it available again once its crawl delay has passed
+    def _release_domain(self, domain, next_ok):
+        self.domain_slots[domain] = next_ok
+        try:
+            self.conn.execute("INSERT OR REPLACE INTO domain_slots VALUES (?, ?)", (domain, next_ok))
+            self.conn.commit()
+        except sqlite3.OperationalError:
+            self.conn.rollback()
 
     def start_crawling(self):
         self.running = True
@@ -190,58 +644,114 @@ class RespectfulCrawler:
     def stop_crawling(self):
         self.running = False
 
-    def crawl_worker(self):
-        while self.running:
-            try:
-                # Check database for URLs with retry logic
-                retry_count = 0
-                url = None
-                priority = None
-
-                while retry_count < 3:
-                    try:
-                        with self.lock:
-                            c = self.conn.cursor()
-                            c.execute("SELECT url, priority FROM crawl_queue ORDER BY priority, added_at LIMIT 1")
-                            result = c.fetchone()
-
-                            if result:
-                                url, priority = result
-                                c.execute("DELETE FROM crawl_queue WHERE url = ?", (url,))
-                                self.conn.commit()
-                        break
-                    except sqlite3.OperationalError:
-                        # If database is locked, wait and retry
-                        retry_count += 1
-                        time.sleep(1)
-                    except Exception as e:
-                        break
-
-                if not url:
-                    # If queue is empty in DB, wait and try again
-                    time.sleep(1)
-                    continue
-
-                if url not in self.visited_urls:
-                    self.visited_urls.add(url)
-                    links = self.crawl_page(url)
-
-                    # Add new links to the queue with lower priority
-                    for link in links:
-                        if link not in self.visited_urls:
-                            self.add_url_to_queue(link, priority + 1)
+    def _finish_crawl(self, task, url, priority, domain):
+        try:
+            page, links, delay = task.result()
+        except Exception as e:
+            page, links, delay = None, [], self.crawl_delay
 
-                # Short pause between operations
-                time.sleep(0.1)
+        # Respect crawl delays per domain
+        self._release_domain(domain, time.time() + delay)
 
-            except Exception as e:
-                time.sleep(5)  # Wait a bit longer if there's an error
+        if page:
+            # Buffer the page; it is written with the next batch
+            self._pending_pages.append(page)
 
+        # Add new links to the queue with lower priority
+        self.add_urls_to_queue(links, priority + 1)
 
-# Function to get favicon for a domain
-def get_favicon(url):
+    # Runs the crawler's event loop on this (background) thread
+    def crawl_worker(self):
+        asyncio.run(self._crawl_main())
+
+    # Dispatches fetches as tasks on the event loop; all database writes stay on this thread
+    async def _crawl_main(self):
+        connector = aiohttp.TCPConnector(limit=self.max_workers * 2, limit_per_host=2)
+        timeout = aiohttp.ClientTimeout(total=15)
+        headers = {'User-Agent': self.session.headers['User-Agent']}
+        in_flight = {}  # Task -> (url, priority, domain)
+        backlog = []  # Claimed URLs waiting for their domain's next slot
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers) as session:
+            while self.running:
+                try:
+                    if len(backlog) < self.max_workers * 4 and time.time() >= self._next_dequeue:
+                        domain_counts = {}
+                        for url, _ in backlog:
+                            domain = urlparse(url).netloc
+                            domain_counts[domain] = domain_counts.get(domain, 0) + 1
+                        for _, _, domain in in_flight.values():
+                            domain_counts[domain] = domain_counts.get(domain, 0) + 1
+
+                        batch = self._dequeue_batch(domain_counts)
+                        if not batch:
+                            self._next_dequeue = time.time() + 1
+                        backlog.extend(batch)
+
+                    # Start at most one fetch per domain whose slot has opened
+                    now = time.time()
+                    busy_domains = {domain for _, _, domain in in_flight.values()}
+                    candidates = {}  # Domain -> (url, priority)
+                    waiting = []
+                    for url, priority in backlog:
+                        if url in self.visited:
+                            continue
+
+                        domain = urlparse(url).netloc
+                        if (len(in_flight) + len(candidates) >= self.max_workers
+                                or domain in busy_domains or domain in candidates
+                                or self.domain_slots.get(domain, 0) > now):
+                            waiting.append((url, priority))
+                            continue
+
+                        candidates[domain] = (url, priority)
+
+                    claimed = self._claim_domains(candidates, now)
+                    for domain, (url, priority) in candidates.items():
+                        if domain not in claimed:
+                            waiting.append((url, priority))
+                            continue
+
+                        self.visited.add(url)
+                        task = asyncio.create_task(self.crawl_page(session, url))
+                        in_flight[task] = (url, priority, domain)
+                    backlog = waiting
+
+                    if in_flight:
+                        done, _ = await asyncio.wait(in_flight, timeout=0.1,
+                                                     return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            self._finish_crawl(task, *in_flight.pop(task))
+                    elif not backlog:
+                        # If queue is empty in DB, write out buffered pages and try again
+                        self._flush_pages()
+                        await asyncio.sleep(1)
+                        continue
+                    else:
+                        await asyncio.sleep(0.1)
+
+                    if (len(self._pending_pages) >= self.flush_every
+                            or time.time() - self._last_flush >= self.flush_interval):
+                        self._flush_pages()
+
+                except Exception as e:
+                    await asyncio.sleep(5)  # Wait a bit longer if there's an error
+
+            # Let running fetches finish, and put back the URLs we claimed but did not get to
+            if in_flight:
+                await asyncio.wait(in_flight)
+            for task in list(in_flight):
+                self._finish_crawl(task, *in_flight.pop(task))
+
+        for url, priority in backlog:
+            self.add_url_to_queue(url, priority)
+        self._flush_pages()
+
+
+# Function to get favicon for a domain; results repeat across searches, so memoize them
+@functools.lru_cache(maxsize=4096)
+def get_favicon(domain):
     try:
-        domain = urlparse(url).netloc
         favicon_url = f"https://www.google.com/s2/favicons?domain={domain}&sz=32"
         return favicon_url
     except:
@@ -257,56 +767,44 @@ def simple_search(query, db_conn, limit=20):
     if not keywords:
         return []
 
-    # Construct search pattern with extracted keywords
-    search_patterns = [f"%{kw}%" for kw in keywords]
+    # Quote each keyword so FTS5 treats it as a plain term, and OR them together
+    match_query = " OR ".join(f'"{kw}"' for kw in keywords)
 
-    retry_count = 0
+    try:
+        c = db_conn.cursor()
 
-    while retry_count < 3:
-        try:
-            c = db_conn.cursor()
-
-            # Dynamic SQL query using multiple keywords
-            query_conditions = " OR ".join(["title LIKE ? OR content LIKE ? OR url LIKE ?"] * len(keywords))
-            query_params = [param for kw in search_patterns for param in
-                            (kw, kw, kw)]  # Duplicate for title, content, URL
-
-            c.execute(f'''
-            SELECT url, title, content 
-            FROM pages 
-            WHERE {query_conditions}
-            ''', query_params)
-
-            results = c.fetchall()
-
-            # Rank results by keyword occurrence
-            def rank_result(result):
-                url, title, content = result
-                title = title or ""
-                content = content or ""
-                url = url or ""
-
-                score = sum(
-                    title.lower().count(kw) * 3 +
-                    url.lower().count(kw) * 2 +
-                    content.lower().count(kw)
-                    for kw in keywords
-                )
-                return score
-
-            sorted_results = sorted(results, key=rank_result, reverse=True)[:limit]
-            return sorted_results
+        # bm25 weights per column (url, title, content); lower scores rank higher
+        c.execute('''
+        SELECT url, title, content
+        FROM pages_fts
+        WHERE pages_fts MATCH ?
+        ORDER BY bm25(pages_fts, 2.0, 3.0, 1.0)
+        LIMIT ?
+        ''', (match_query, limit))
 
-        except sqlite3.OperationalError:
-            retry_count += 1
-            time.sleep(1)
-        except Exception as e:
-            st.error(f"Search error: {str(e)}")
-            break
+        return c.fetchall()
+
+    except Exception as e:
+        st.error(f"Search error: {str(e)}")
 
     return []
 
 
+# Cache results across reruns; version changes whenever new pages are indexed.
+# The leading underscore keeps Streamlit from hashing the connection.
+@st.cache_data(ttl=60, max_entries=512)
+def cached_search(query, limit, version, _db_conn):
+    return simple_search(query, _db_conn, limit)
+
+
+# Compile one pattern matching any keyword of the query, shared by every result
+@functools.lru_cache(maxsize=256)
+def highlight_pattern(query):
+    keywords = sorted(set(extract_keywords(query)), key=len, reverse=True)
+    if not keywords:
+        return None
+    # Whole words only, so short keywords like "c" don't light up inside other words
+    return re.compile(r'\b(?:' + '|'.join(map(re.escape, keywords)) + r')\b', re.IGNORECASE)
 
 
 # Function to highlight search terms in text
@@ -316,8 +814,9 @@ def highlight_terms(text, query):
 
     highlighted = text
     try:
-        pattern = re.compile(re.escape(query), re.IGNORECASE)
-        highlighted = pattern.sub(f'<span class="highlight">{query}</span>', highlighted)
+        pattern = highlight_pattern(query)
+        if pattern:
+            highlighted = pattern.sub(r'<span class="highlight">\g<0></span>', highlighted)
     except:
         pass
 
@@ -460,11 +959,14 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Initialize the database connection
+# Initialize the database
 conn = init_db()
 
+# Read-only connection for search and sidebar queries
+reader = get_reader()
+
 # Initialize the crawler
-crawler = RespectfulCrawler(conn)
+crawler = RespectfulCrawler()
 
 
 # Make sure we have some data in the database
@@ -474,7 +976,8 @@ def ensure_data():
     count = c.fetchone()[0]
 
     if count == 0:
-        # Add some sample data if database is empty
+        # Add some sample data if database is empty; last_crawled stays NULL so
+        # the sample URL still counts as uncrawled and gets queued as a seed
         sample_data = [
             (
                 "https://moz.com/top500",
@@ -486,7 +989,7 @@ def ensure_data():
         for url, title, content in sample_data:
             c.execute(
                 "INSERT OR IGNORE INTO pages VALUES (?, ?, ?, ?, ?)",
-                (url, title, content, datetime.now(), datetime.now())
+                (url, title, content, datetime.now(), None)
             )
 
         conn.commit()
@@ -495,6 +998,20 @@ def ensure_data():
 # Make sure we have data
 ensure_data()
 
+# Show the outcome of adding a URL from the sidebar
+def report_queue_status(status, url, added_message):
+    if status == QUEUED:
+        st.success(added_message)
+    elif status == ALREADY_QUEUED:
+        st.info(f"{url} is already in the crawler queue.")
+    elif status == ALREADY_INDEXED:
+        st.info(f"{url} is already indexed.")
+    elif status == INVALID_URL:
+        st.warning(f"{url} is not a valid http(s) URL.")
+    else:
+        st.error(f"Could not add {url}: the database is busy, please try again.")
+
+
 # App title
 st.markdown('<h1 class="main-header">🕊️ Dove Search</h1>', unsafe_allow_html=True)
 
@@ -508,8 +1025,9 @@ with st.sidebar:
             st.rerun()
     if st.button("Add to Front of Queue"):
         if high_priority_url:
-            crawler.add_url_to_queue(high_priority_url, priority=0)  # Highest priority
-            st.success(f"Added {high_priority_url} to the front of the queue.")
+            status = crawler.add_url_to_queue(high_priority_url, priority=0)  # Highest priority
+            report_queue_status(status, high_priority_url,
+                                f"Added {high_priority_url} to the front of the queue.")
 
     # Normal URL addition (admin mode)
     if 'admin_mode' not in st.session_state:
@@ -520,8 +1038,8 @@ with st.sidebar:
 
         if st.button("Add URL to Crawler Queue"):
             if seed_url:
-                crawler.add_url_to_queue(seed_url, priority=1)  # Normal priority
-                st.success(f"Added {seed_url} to crawler queue")
+                status = crawler.add_url_to_queue(seed_url, priority=1)  # Normal priority
+                report_queue_status(status, seed_url, f"Added {seed_url} to crawler queue")
 
     # Crawler status and controls
     crawler_status = st.empty()
@@ -540,26 +1058,19 @@ with st.sidebar:
     # Show crawler stats
     st.subheader("Crawler Stats")
 
-    # Count pages in the database with retry logic
-    retry_count = 0
+    # Count pages in the database
     page_count = 0
     queue_count = 0
 
-    while retry_count < 3:
-        try:
-            c = conn.cursor()
-            c.execute("SELECT COUNT(*) FROM pages")
-            page_count = c.fetchone()[0]
+    try:
+        c = reader.cursor()
+        c.execute("SELECT COUNT(*) FROM pages")
+        page_count = c.fetchone()[0]
 
-            c.execute("SELECT COUNT(*) FROM crawl_queue")
-            queue_count = c.fetchone()[0]
-            break
-        except sqlite3.OperationalError:
-            # If database is locked, wait and retry
-            retry_count += 1
-            time.sleep(1)
-        except Exception as e:
-            break
+        c.execute("SELECT COUNT(*) FROM crawl_queue")
+        queue_count = c.fetchone()[0]
+    except sqlite3.OperationalError:
+        pass
 
     st.metric("Pages Indexed", page_count)
     st.metric("URLs in Queue", queue_count)
@@ -574,21 +1085,14 @@ with st.sidebar:
     # Display the last 5 crawled pages
     st.subheader("Recently Indexed Pages")
 
-    retry_count = 0
     recent_pages = []
 
-    while retry_count < 3:
-        try:
-            c = conn.cursor()
-            c.execute("SELECT url, last_crawled FROM pages ORDER BY last_crawled DESC LIMIT 5")
-            recent_pages = c.fetchall()
-            break
-        except sqlite3.OperationalError:
-            # If database is locked, wait and retry
-            retry_count += 1
-            time.sleep(1)
-        except Exception as e:
-            break
+    try:
+        c = reader.cursor()
+        c.execute("SELECT url, last_crawled FROM pages WHERE last_crawled IS NOT NULL ORDER BY last_crawled DESC LIMIT 5")
+        recent_pages = c.fetchall()
+    except sqlite3.OperationalError:
+        pass
 
     for url, timestamp in recent_pages:
         st.markdown(f'<div class="recent-page"><b>{url}</b><br/><small>Indexed: {timestamp}</small></div>',
@@ -598,8 +1102,9 @@ with st.sidebar:
 search_query = st.text_input("Search for:", "")
 
 if search_query:
-    # Get search results with simple search to ensure it works
-    results = simple_search(search_query, conn)
+    # Get search results, reusing cached ones until new pages land
+    index_version = reader.execute("SELECT MAX(last_crawled) FROM pages").fetchone()[0]
+    results = cached_search(search_query, 20, index_version, reader)
 
     # Display search stats
     st.markdown(f'<div class="search-stats">Found {len(results)} results for "{search_query}"</div>',
@@ -613,7 +1118,7 @@ if search_query:
     # Display results with favicons
     for url, title, content in results:
         # Get favicon for the URL
-        favicon_url = get_favicon(url)
+        favicon_url = get_favicon(urlparse(url).netloc)
 
         # Ensure content is not None and highlight search terms
         content_snippet = content[:300] + "..." if content and len(content) > 300 else content or ""
@@ -647,8 +1152,7 @@ if 'first_run' not in st.session_state:
         "https://en.wikipedia.org/wiki/PageRank",
         "https://en.wikipedia.org/wiki/Google",
     ]
-    for seed in default_seeds:
-        crawler.add_url_to_queue(seed)
+    crawler.add_urls_to_queue(default_seeds)
     crawler.start_crawling()
     st.session_state.crawler_running = True
 